@@ -8,12 +8,29 @@ Description: We created a program that predicts the rating that a user would giv
              Predicted and actual ratings are compared to test the accuracy of the program.
 """
 import math
-import csv
-from scipy.stats import pearsonr
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
 
 class BadInputError(Exception):
     pass
 
+def round_column(values, digits):
+    """
+    Returns a float64 array of values rounded to digits decimals, with
+    exactly the results of Python's round().  np.round scales by 10**digits
+    and so can differ from round() (np.round(2.675, 2) is 2.68, round()
+    gives 2.67); but where it leaves a value unchanged the value is already
+    on the grid and round() agrees, so only the other values are rounded
+    one at a time.
+    """
+    values = np.asarray(values, dtype = np.float64)
+    rounded = np.round(values, digits)
+    off_grid = rounded != values
+    if off_grid.any():
+        rounded[off_grid] = [round(value, digits) for value in values[off_grid].tolist()]
+    return rounded
+
 class Movie_Recommendations:
     # Constructor
     def __init__(self, movie_filename, training_ratings_filename):
@@ -26,11 +43,53 @@ class Movie_Recommendations:
         self.user_dict - A dictionary that maps user id's to a 
                a dictionary that maps a movie id to the rating
                that the user gave to the movie.    
+        self.movie_index - A dictionary that maps a movie id to its
+               column in the ratings matrix.
+        self.movie_titles - A list of the movie titles, by column.
+        self.user_index - A dictionary that maps a user id to its
+               row in the ratings matrix.
+        self.user_ids - An array of the user ids, by row.
+        self.movie_user_offsets, self.movie_user_indices,
+        self.movie_user_ratings - The rows of the users who rated each
+               movie and their ratings, in CSR form: the users of the
+               movie in column c are movie_user_indices[
+               movie_user_offsets[c]:movie_user_offsets[c + 1]].
+        self.R - A sparse (users x movies) float32 matrix of the ratings.
+        self.P - A sparse (users x movies) float32 matrix with a 1 where
+               the user rated the movie.  (A rating can be 0, so this
+               is not the same as R != 0.)
+        self.R_csr - self.R in CSR form, for reading a user's ratings.
+        self.user_rated_cols - A dictionary that maps a user id to
+               the columns of the movies the user rated.
+        self.user_ratings_vec - A dictionary that maps a user id to
+               the ratings the user gave, in the same order.
+        self.sim_left, self.sim_right - The stacked sparse terms whose
+               product gives the similarity numerators (see
+               makeSimilarityTerms).  None until first needed.
+        self.sim_matrix - A (movies x movies) float32 matrix of the
+               similarities between every pair of movies.  None until
+               makeSimilarityMatrix is called, which predict_ratings
+               does when its test file covers most of the movies.
+        self.predicted - A dictionary that maps (user id, movie id) to
+               the rating predict_rating computed for it, kept in least
+               recently used order and capped at self.predicted_maxsize
+               entries.  predict_ratings neither reads nor fills it.
         """ 
         #Compile movie_dict and user_dict
         self.movie_dict = self.makeMovieDict(movie_filename) 
 
         self.user_dict = self.makeUserDict(training_ratings_filename)
+
+        self.makeRatingsMatrix()
+
+        #Built on demand: a full similarity matrix only pays off for batch predictions
+        self.sim_left = None
+        self.sim_right = None
+        self.sim_matrix = None
+
+        #LRU cache of predict_rating results
+        self.predicted = {}
+        self.predicted_maxsize = 200000
         
     def makeMovieDict(self,movie_filename):
         """
@@ -38,12 +97,12 @@ class Movie_Recommendations:
         Create self.movie_dict.
         """
         self.movie_dict = {}
-        mf = open(movie_filename, encoding = 'utf-8')
-        mf.readline()
-        csv_reader = csv.reader(mf, delimiter = ',', quotechar = '"')
-        for line in csv_reader:
-            self.movie_dict[int(line[0])] = Movie(line[0],line[1])  #key = movie id: value = object
-        mf.close()
+        mf = pd.read_csv(movie_filename, usecols = [0, 1], dtype = {0: 'int64', 1: str},
+                         encoding = 'utf-8', keep_default_na = False, engine = 'c')
+        for movieID, title in zip(mf.iloc[:, 0].tolist(), mf.iloc[:, 1].tolist()):
+            self.movie_dict[movieID] = Movie(movieID, title)  #key = movie id: value = object
+        self.movie_index = {movieID: col for col, movieID in enumerate(self.movie_dict)}
+        self.movie_titles = [movie.title for movie in self.movie_dict.values()]
         return self.movie_dict
 
     def makeUserDict(self,training_ratings_filename):
@@ -54,21 +113,137 @@ class Movie_Recommendations:
         file.
         """
         self.user_dict = {}
-        tr = open(training_ratings_filename, encoding = 'utf-8')
-        tr.readline()
-        csv_reader = csv.reader(tr, delimiter = ',', quotechar = '"')
-        for line in csv_reader:
-            userID = int(line[0]) #Userid
-            movieID = int(line[1]) #MovieID
-            rating = round(float(line[2]), 2) #rating for movie by user
-            #Assign a new dictionary for each new user
-            usr_rating = self.user_dict.setdefault(userID,{})
-            usr_rating[movieID] = rating
-            if userID not in self.movie_dict[movieID].users:
-                self.movie_dict[movieID].users.append(userID)
-        tr.close()
+        tr = pd.read_csv(training_ratings_filename, usecols = [0, 1, 2],
+                         dtype = {0: 'int64', 1: 'int64', 2: 'float64'}, encoding = 'utf-8', engine = 'c')
+        #A later rating of the same movie by the same user replaces the earlier one
+        tr = tr.drop_duplicates(subset = list(tr.columns[:2]), keep = 'last')
+        user_col = tr.iloc[:, 0].to_numpy()
+        movie_col = tr.iloc[:, 1].to_numpy()
+        ratings = round_column(tr.iloc[:, 2].to_numpy(), 2) #rating for movie by user
+        #Users are numbered in order of their first rating in the file
+        self.user_ids = pd.unique(user_col).astype(np.int64)
+        self.user_index = {userID: row for row, userID in enumerate(self.user_ids.tolist())}
+        user_rows = pd.Index(self.user_ids).get_indexer(user_col).astype(np.int32)
+        #Group the ratings by user with one stable sort, so each user's
+        #movies stay in file order, and slice out each user's dictionary
+        order = np.argsort(user_rows, kind = 'stable')
+        boundaries = np.searchsorted(user_rows[order], np.arange(len(self.user_ids) + 1)).tolist()
+        user_movies = movie_col[order].tolist()
+        user_ratings = ratings[order].tolist()
+        for userID, start, end in zip(self.user_ids.tolist(), boundaries, boundaries[1:]):
+            self.user_dict[userID] = dict(zip(user_movies[start:end], user_ratings[start:end]))
+        movie_cols = pd.Index(list(self.movie_index)).get_indexer(movie_col).astype(np.int32)
+        if (movie_cols < 0).any():
+            raise BadInputError
+        #Group the (user, movie) pairs by movie: count the ratings of each
+        #movie to get the offsets, then place the user rows in movie order
+        #(sorted by user row within each movie)
+        self.movie_user_offsets = np.zeros(len(self.movie_index) + 1, dtype = np.int64)
+        np.cumsum(np.bincount(movie_cols, minlength = len(self.movie_index)), out = self.movie_user_offsets[1:])
+        order = np.lexsort((user_rows, movie_cols))
+        self.movie_user_indices = user_rows[order]
+        self.movie_user_ratings = ratings[order].astype(np.float32)
+        #Each movie's users list keeps the user ids in file order
+        movie_users = user_col[np.argsort(movie_cols, kind = 'stable')].tolist()
+        offsets = self.movie_user_offsets.tolist()
+        for movieID, col in self.movie_index.items():
+            self.movie_dict[movieID].users = movie_users[offsets[col]:offsets[col + 1]]
         return self.user_dict
 
+    def makeRatingsMatrix(self):
+        """
+        Build the sparse ratings matrix self.R and the presence matrix
+        self.P straight from the per-movie CSR arrays (so the storage is
+        proportional to the number of ratings), and give each movie views
+        of its raters and their ratings, sorted by user row.
+        """
+        shape = (len(self.user_index), len(self.movie_index))
+        csr = (self.movie_user_indices, self.movie_user_offsets)
+        #copy = True so scipy never reorders the CSR arrays shared with the movies
+        self.R = sp.csc_matrix((self.movie_user_ratings, *csr), shape = shape, copy = True)
+        self.P = sp.csc_matrix((np.ones(len(self.movie_user_indices), dtype = np.float32), *csr), shape = shape, copy = True)
+        self.R_csr = self.R.tocsr()
+        by_user = self.R_csr
+        self.user_rated_cols = {}
+        self.user_ratings_vec = {}
+        for userID, row in self.user_index.items():
+            start, end = by_user.indptr[row], by_user.indptr[row + 1]
+            self.user_rated_cols[userID] = by_user.indices[start:end]
+            self.user_ratings_vec[userID] = by_user.data[start:end]
+        offsets = self.movie_user_offsets
+        for movieID, col in self.movie_index.items():
+            self.movie_dict[movieID].user_rows = self.movie_user_indices[offsets[col]:offsets[col + 1]]
+            self.movie_dict[movieID].ratings = self.movie_user_ratings[offsets[col]:offsets[col + 1]]
+
+    def makeSimilarityTerms(self):
+        """
+        Build self.sim_left and self.sim_right, stacked so that for any two
+        sets of movies, sim_left[:, a].T @ sim_right[:, b] is the sum of
+        |r_i - r_j| over the users who rated both movies.  That sum is
+        rated_sums + rated_sums.T - 2 * min_sums, with rated_sums = R.T @ P,
+        where min_sums (the sum of min(r_i, r_j)) is built from one product
+        of indicator matrices per distinct rating value.  All terms are
+        sparse, so only pairs of movies with a common viewer are touched.
+        """
+        R = self.R
+        P = self.P
+        levels = np.unique(R.data)
+        left = [R, P]
+        right = [P, R]
+        if len(levels) > 0:
+            left.append(P)
+            right.append(-2 * float(levels[0]) * P)
+        for low, high in zip(levels, levels[1:]):
+            at_least = sp.csc_matrix(((R.data >= high).astype(np.float32), R.indices, R.indptr), shape = R.shape, copy = True)
+            at_least.eliminate_zeros()
+            left.append(at_least)
+            right.append(-2 * float(high - low) * at_least)
+        self.sim_left = sp.vstack(left, format = 'csc')
+        self.sim_right = sp.vstack(right, format = 'csc')
+
+    def similarityBlock(self, rows, cols):
+        """
+        Returns a dense float32 array of the similarities of the movies
+        in rows with the movies in cols (each a slice or an array of
+        columns; rows = None means every movie).  Pairs with no common
+        viewer get similarity 0.
+        """
+        if self.sim_left is None:
+            self.makeSimilarityTerms()
+        P = self.P
+        left = self.sim_left
+        #Slicing every column would only copy the matrices
+        if rows is None:
+            P_rows = P
+        else:
+            P_rows = P[:, rows]
+            left = left[:, rows]
+        counts = (P_rows.T @ P[:, cols]).tocsr() #number of users that viewed both movies
+        diff_sums = left.T @ self.sim_right[:, cols]
+        #similarity = 1 - diffs_avg/4.5, and 0 if no user viewed both movies
+        inv_counts = counts.copy()
+        inv_counts.data = 1/(4.5 * inv_counts.data)
+        counts.data[:] = 1
+        return (counts - diff_sums.multiply(inv_counts)).toarray()
+
+    def makeSimilarityMatrix(self, block_size = 256):
+        """
+        Compute the similarity between every pair of movies and store it
+        in self.sim_matrix.  The matrix is filled in blocks of block_size
+        columns, computing only the part on or above the diagonal and
+        mirroring it, so only one block of intermediate results is held
+        at a time.
+        """
+        if self.sim_left is None:
+            self.makeSimilarityTerms()
+        num_movies = self.P.shape[1]
+        self.sim_matrix = np.zeros((num_movies, num_movies), dtype = np.float32)
+        for start in range(0, num_movies, block_size):
+            end = min(start + block_size, num_movies)
+            #similarities of movies [0, end) with movies [start, end)
+            self.sim_matrix[:end, start:end] = self.similarityBlock(slice(0, end), slice(start, end))
+            self.sim_matrix[start:end, :start] = self.sim_matrix[:start, start:end].T
+
     def predict_rating(self, user_id, movie_id):
         """
         Returns the predicted rating that user_id will give to the
@@ -80,20 +255,28 @@ class Movie_Recommendations:
         """
         if user_id not in self.user_dict or movie_id not in self.movie_dict:
             raise BadInputError
-        if user_id in self.movie_dict[movie_id].users:
+        if movie_id in self.user_dict[user_id]:
             return self.user_dict[user_id][movie_id]
+        elif (user_id, movie_id) in self.predicted:
+            #move the entry to the most recently used end
+            predicted_rating = self.predicted.pop((user_id, movie_id))
+            self.predicted[(user_id, movie_id)] = predicted_rating
+            return predicted_rating
         else:
-            rxs_lst = [] #list for all rate*similarities
-            sim_lst = [] #list for the similarities
-            for movie in self.user_dict[user_id]:
-                rate_x = self.user_dict[user_id][movie] 
-                sim_x = self.movie_dict[movie].get_similarity(movie_id, self.movie_dict, self.user_dict)
-                sim_lst.append(sim_x) #append similarities separately to take sum later
-                ratexsim = rate_x * sim_x  #rate * similarity
-                rxs_lst.append(ratexsim) 
-            if sum(sim_lst) == 0:
-                return 2.5 
-            predicted_rating = sum(rxs_lst)/sum(sim_lst) #To find predicted rating...
+            #similarities between each movie the user rated and movie_id
+            col = self.movie_index[movie_id]
+            if self.sim_matrix is not None:
+                sim = self.sim_matrix[self.user_rated_cols[user_id], col]
+            else:
+                sim = self.similarityBlock(self.user_rated_cols[user_id], [col])[:, 0]
+            sim_sum = float(sim.sum())
+            if sim_sum == 0:
+                predicted_rating = 2.5
+            else:
+                predicted_rating = float(self.user_ratings_vec[user_id] @ sim)/sim_sum #To find predicted rating...
+            if len(self.predicted) >= self.predicted_maxsize:
+                del self.predicted[next(iter(self.predicted))] #evict the least recently used
+            self.predicted[(user_id, movie_id)] = predicted_rating
             return predicted_rating
         
     def predict_ratings(self, test_ratings_filename):
@@ -103,18 +286,45 @@ class Movie_Recommendations:
         The tuple should contain
         (user id, movie title, predicted rating, actual rating)
         """
+        trf = pd.read_csv(test_ratings_filename, usecols = [0, 1, 2],
+                          dtype = {0: 'int64', 1: 'int64', 2: 'float64'}, engine = 'c')
+        user_col = trf.iloc[:, 0].tolist()
+        movie_col = trf.iloc[:, 1].tolist()
+        user_rows = pd.Index(self.user_ids).get_indexer(user_col)
+        movie_cols = pd.Index(list(self.movie_index)).get_indexer(movie_col)
+        if (user_rows < 0).any() or (movie_cols < 0).any():
+            raise BadInputError
+        #Only the similarity columns of the test movies are needed; once they
+        #are more than half of all movies, build the (symmetric, so cheaper
+        #per column) full matrix instead and keep it for later calls
+        target_cols, target_of = np.unique(movie_cols, return_inverse = True)
+        if self.sim_matrix is None and len(target_cols) > len(self.movie_index) // 2:
+            self.makeSimilarityMatrix()
+        if self.sim_matrix is not None:
+            sim_cols = self.sim_matrix
+            target_of = movie_cols
+        else:
+            sim_cols = self.similarityBlock(None, target_cols)
+        #Gather, for every test rating, the ratings of its user and the
+        #similarities of the rated movies to its movie, then sum per test rating
+        by_user = self.R_csr
+        starts = by_user.indptr[user_rows]
+        lengths = by_user.indptr[user_rows + 1] - starts
+        test_of = np.repeat(np.arange(len(trf)), lengths)
+        positions = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        sim = sim_cols[by_user.indices[positions], target_of[test_of]]
+        sim_sums = np.bincount(test_of, weights = sim, minlength = len(trf))
+        rxs_sums = np.bincount(test_of, weights = by_user.data[positions] * sim, minlength = len(trf))
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            predicted = np.where(sim_sums == 0, 2.5, rxs_sums/sim_sums).tolist()
         predicted_ratings = []
-        trf = open(test_ratings_filename,'r')
-        trf.readline()
-        csv_reader = csv.reader(trf, delimiter = ',', quotechar = '"')
-        for line in csv_reader:
-            user_id = int(line[0])
-            movie = str(self.movie_dict[int(line[1])].title)
-            test_rating = round(float(line[2]), 1)
-            predicted_rating = self.predict_rating(user_id,int(line[1])) #call predict_rating for each line
+        test_ratings = round_column(trf.iloc[:, 2].to_numpy(), 1).tolist()
+        for user_id, movie_id, predicted_rating, test_rating in zip(user_col, movie_col, predicted, test_ratings):
+            movie = self.movie_titles[self.movie_index[movie_id]]
+            #A movie the user already rated keeps that rating
+            predicted_rating = self.user_dict[user_id].get(movie_id, predicted_rating)
             tup = (user_id, movie, predicted_rating, test_rating)
             predicted_ratings.append(tup)
-        trf.close()
         return predicted_ratings
 
     def correlation(self, predicted_ratings, actual_ratings):
@@ -123,7 +333,12 @@ class Movie_Recommendations:
         and the list actual_ratings.  The lengths of predicted_ratings and
         actual_ratings must be the same.
         """
-        return pearsonr(predicted_ratings, actual_ratings)[0]
+        #Pearson's r is the dot product of the mean-centered, normalized vectors
+        predicted = np.asarray(predicted_ratings, dtype = np.float64)
+        actual = np.asarray(actual_ratings, dtype = np.float64)
+        predicted = predicted - predicted.mean()
+        actual = actual - actual.mean()
+        return float(predicted @ actual/(np.linalg.norm(predicted) * np.linalg.norm(actual)))
         
 class Movie: 
     """
@@ -138,15 +353,20 @@ class Movie:
         id: the id of the movie
         title: the title of the movie
         users: list of the id's of the users who have
-            rated this movie.  Initially, this is
-            an empty list, but will be filled in
-            as the training ratings file is read.
+            rated this movie, in the order of the
+            training ratings file.  Initially, this is
+            an empty list, but is filled in once the
+            training ratings file is read.
         similarities: a dictionary where the key is the
             id of another movie, and the value is the similarity
             between the "self" movie and the movie with that id.
             This dictionary is initially empty.  It is filled
             in "on demand", as the file containing test ratings
             is read, and ratings predictions are made.
+        user_rows: the rows of the users who rated this
+            movie, sorted.  Set once the training
+            ratings are loaded.
+        ratings: the ratings those users gave this movie.
         """   
         #Initialize global variables
         self.title = title
@@ -182,13 +402,13 @@ class Movie:
         if other_movie_id not in movie_dict:
             raise BadInputError
 
+        cached = self.similarities.get(other_movie_id)
+        if cached is not None:
+            return cached
         similarity = self.compute_similarity(other_movie_id, movie_dict, user_dict)
-        if similarity in movie_dict[self.id].similarities and similarity in movie_dict[other_movie_id].similarities:
-            return similarity
-        else:
-            movie_dict[self.id].similarities[other_movie_id] = similarity
-            movie_dict[other_movie_id].similarities[self.id] = similarity
-            return similarity
+        self.similarities[other_movie_id] = similarity
+        movie_dict[other_movie_id].similarities[self.id] = similarity
+        return similarity
 
     def compute_similarity(self, other_movie_id, movie_dict, user_dict):
         """ 
@@ -196,15 +416,20 @@ class Movie:
         called the method (self), and another movie whose
         id is other_movie_id.  (Uses movie_dict and user_dict)
         """
-        diff_lst = []
-        #I made a list for the users that viewed BOTH movies
-        usr_both = set(movie_dict[self.id].users).intersection(set(movie_dict[other_movie_id].users))
-        if len(usr_both) == 0:
+        other = movie_dict[other_movie_id]
+        #Positions of the users that viewed BOTH movies.  Both user_rows
+        #arrays are already sorted, so a binary search of one for the
+        #other finds them without building sets or re-sorting per call
+        if len(self.user_rows) == 0 or len(other.user_rows) == 0:
+            return 0
+        others = np.searchsorted(other.user_rows, self.user_rows)
+        others[others == len(other.user_rows)] = 0
+        usr_both = other.user_rows[others] == self.user_rows
+        num_both = np.count_nonzero(usr_both)
+        if num_both == 0:
             return 0
-        for x in usr_both:
-            diff = user_dict[x].get(self.id) - user_dict[x].get(other_movie_id)
-            diff_lst.append(abs(diff))
-        diffs_avg = sum(diff_lst)/len(diff_lst)
+        diffs = np.abs(self.ratings[usr_both] - other.ratings[others[usr_both]])
+        diffs_avg = float(diffs.sum())/num_both
         similarity = 1 - diffs_avg/4.5
         return similarity
 
@@ -5,6 +5,7 @@
 #              of comp 120, psa4,
 #              on a small dummy set of ratings.
 
+import math
 import sys
 
 # import the module containing psa4 solution
@@ -37,6 +38,25 @@ def test_psa4():
                     (0, 0.33,0.56,0.67,1,0.56),
                     (0, 0.78,1.00,0.33,0.56, 1))
 
+    # Test round_column against Python's round
+    try:
+        num_tested += 1
+        print("Testing round_column against round.")
+
+        values = [2.675, 1.005, float("nan"), 0.0, 0.5, 1.5, 2.5, 3.5, 4.5, 5.0]
+        for digits in (1, 2):
+            rounded = movie_recommendations.round_column(values, digits).tolist()
+            for value, result in zip(values, rounded):
+                expected = round(value, digits)
+                if result != expected and not (math.isnan(result) and math.isnan(expected)):
+                    raise IncorrectCode(f"round_column gives {result} for {value} at {digits} digits.  round gives {expected}")
+        print("  passed")
+        num_correct += 1
+    except IncorrectCode as e:
+        print(f"  failed. {e}")
+    except Exception as e:
+        print(f"  failed.  Your code raised the exception {e}")
+
     # Test movie_dict of Movie_Recommendations constructor
     try:
         num_tested += 1
@@ -134,6 +154,30 @@ def test_psa4():
     except Exception as e:
         print(f"  failed.  Your code raised the exception {e}")
 
+    # Test sim_matrix against compute_similarity
+    try:
+        num_tested += 1
+        print("Testing sim_matrix against compute_similarity.")
+
+        mr = movie_recommendations.Movie_Recommendations(
+            "dummy_movies.csv", "dummy_training_ratings.csv")
+        ud = mr.user_dict
+        md = mr.movie_dict
+        mr.makeSimilarityMatrix()
+        for movie_id in md:
+            for other_movie_id in md:
+                if movie_id != other_movie_id:
+                    similarity = md[movie_id].compute_similarity(other_movie_id, md, ud)
+                    sim = mr.sim_matrix[mr.movie_index[movie_id], mr.movie_index[other_movie_id]]
+                    if abs(similarity - sim) > 1e-6:
+                        raise IncorrectCode(f"sim_matrix entry for {movie_id} and {other_movie_id} is {sim}.  compute_similarity gives {similarity}")
+        print("  passed")
+        num_correct += 1
+    except IncorrectCode as e:
+        print(f"  failed. {e}")
+    except Exception as e:
+        print(f"  failed.  Your code raised the exception {e}")
+
     # Test predict_rating with a valid user id and valid movie id
     num_tested += 1
     print("Testing predict_rating with a valid user id and valid movie id")
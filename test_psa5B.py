@@ -67,6 +67,49 @@ def test_psa4():
     except Exception as e:
         print(f"  failed.  Your code raised the exception {e}")
         print(f"Should be {0.47}")
+
+
+    # test that building the full similarity matrix does not change predict_ratings
+    num_tested += 1
+    print("Testing predict_ratings before and after makeSimilarityMatrix")
+    try:
+        rc = movie_recommendations.Movie_Recommendations(
+            "movies.csv", "training_ratings.csv")
+        before = rc.predict_ratings("test_ratings.csv")
+        rc.makeSimilarityMatrix()
+        after = rc.predict_ratings("test_ratings.csv")
+        if before == after:
+            print("  passed")
+            num_correct += 1
+        else:
+            print("  failed.  predict_ratings returned different ratings once sim_matrix was built")
+    except Exception as e:
+        print(f"  failed.  Your code raised the exception {e}")
+
+    # test sim_matrix against compute_similarity for the movies in the test ratings
+    num_tested += 1
+    print("Testing sim_matrix against compute_similarity")
+    try:
+        md = rc.movie_dict
+        ud = rc.user_dict
+        with open("test_ratings.csv") as f:
+            next(f)
+            movie_ids = sorted({int(line.split(",")[1]) for line in f})
+        wrong = []
+        for movie_id in movie_ids:
+            for other_movie_id in movie_ids:
+                if movie_id != other_movie_id:
+                    similarity = md[movie_id].compute_similarity(other_movie_id, md, ud)
+                    sim = rc.sim_matrix[rc.movie_index[movie_id], rc.movie_index[other_movie_id]]
+                    if abs(similarity - sim) > 1e-6:
+                        wrong.append((movie_id, other_movie_id, similarity, sim))
+        if not wrong:
+            print("  passed")
+            num_correct += 1
+        else:
+            print(f"  failed.  {len(wrong)} similarities differ, for example {wrong[0]}")
+    except Exception as e:
+        print(f"  failed.  Your code raised the exception {e}")
         
     if num_correct == num_tested:
         print("Everything correct.  Make sure you have followed all")